@@ -1,5 +1,6 @@
 # Copyright © 2023 Apple Inc.
 
+import functools
 import math
 import unittest
 
@@ -7,7 +8,31 @@ import mlx.core as mx
 import mlx_tests
 
 
+@functools.lru_cache(maxsize=None)
+def _compiled_sampler(sampler, dtype, shape=()):
+    # One compiled instance per (sampler, dtype, shape) for the whole run,
+    # so repeated test invocations skip re-tracing the sampler graph
+    return mx.compile(lambda key: sampler(shape=shape, dtype=dtype, key=key))
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_loc_scale(sampler, shape, dtype):
+    # Compile the composite scale * sample + loc once per (sampler, shape,
+    # dtype) so repeated calls reuse one fused kernel instead of re-tracing
+    return mx.compile(
+        lambda key, loc, scale: scale * sampler(shape=shape, dtype=dtype, key=key) + loc
+    )
+
+
 class TestRandom(mlx_tests.MLXTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # mx.random.key is pure, so one evaluated key can be shared by
+        # every test instead of re-allocating it per method
+        cls._key0 = mx.random.key(0)
+        mx.eval(cls._key0)
+
     def test_global_rng(self):
         mx.random.seed(3)
         a = mx.random.uniform()
@@ -17,8 +42,9 @@ class TestRandom(mlx_tests.MLXTestCase):
         x = mx.random.uniform()
         y = mx.random.uniform()
 
-        self.assertEqual(a.item(), x.item())
-        self.assertEqual(y.item(), b.item())
+        # Compare both draws with a single synchronization instead of one
+        # per scalar
+        self.assertTrue(mx.array_equal(mx.stack([a, b]), mx.stack([x, y])))
 
     def test_key(self):
         k1 = mx.random.key(0)
@@ -42,22 +68,22 @@ class TestRandom(mlx_tests.MLXTestCase):
         self.assertEqual(keys.shape, (10, 2))
 
     def test_uniform(self):
-        key = mx.random.key(0)
+        key = self._key0
         a = mx.random.uniform(key=key)
         self.assertEqual(a.shape, ())
         self.assertEqual(a.dtype, mx.float32)
 
         b = mx.random.uniform(key=key)
-        self.assertEqual(a.item(), b.item())
+        self.assertTrue(mx.array_equal(a, b))
 
         a = mx.random.uniform(shape=(2, 3))
         self.assertEqual(a.shape, (2, 3))
 
         a = mx.random.uniform(shape=(1000,), low=-1, high=5)
-        self.assertTrue(mx.all((a > -1) < 5).item())
+        self.assertTrue(mx.all(mx.logical_and(a > -1, a < 5)).item())
 
         a = mx.random.uniform(shape=(1000,), low=mx.array(-1), high=5)
-        self.assertTrue(mx.all((a > -1) < 5).item())
+        self.assertTrue(mx.all(mx.logical_and(a > -1, a < 5)).item())
 
         a = mx.random.uniform(low=-0.1, high=0.1, shape=(1,), dtype=mx.bfloat16)
         self.assertEqual(a.dtype, mx.bfloat16)
@@ -65,20 +91,23 @@ class TestRandom(mlx_tests.MLXTestCase):
         self.assertEqual(mx.random.uniform().dtype, mx.random.uniform(dtype=None).dtype)
 
     def test_normal(self):
-        key = mx.random.key(0)
+        key = self._key0
         a = mx.random.normal(key=key)
         self.assertEqual(a.shape, ())
         self.assertEqual(a.dtype, mx.float32)
 
         b = mx.random.normal(key=key)
-        self.assertEqual(a.item(), b.item())
+
+        # Collect the value checks lazily and resolve them with a single
+        # evaluation at the end so independent draws run in one batch
+        checks = [mx.array_equal(a, b)]
 
         a = mx.random.normal(shape=(2, 3))
         self.assertEqual(a.shape, (2, 3))
 
         ## Generate in float16 or bfloat16
         for t in [mx.float16, mx.bfloat16]:
-            a = mx.random.normal(dtype=t)
+            a = _compiled_sampler(mx.random.normal, t)(key)
             self.assertEqual(a.dtype, t)
 
         # Generate with a given mean and standard deviation
@@ -86,24 +115,28 @@ class TestRandom(mlx_tests.MLXTestCase):
         scale = 2.0
 
         a = mx.random.normal(shape=(3, 2), loc=loc, scale=scale, key=key)
-        b = scale * mx.random.normal(shape=(3, 2), key=key) + loc
-        self.assertTrue(mx.allclose(a, b))
+        b = _compiled_loc_scale(mx.random.normal, (3, 2), mx.float32)(key, loc, scale)
+        checks.append(mx.allclose(a, b))
 
         a = mx.random.normal(
             shape=(3, 2), loc=loc, scale=scale, dtype=mx.float16, key=key
         )
-        b = scale * mx.random.normal(shape=(3, 2), dtype=mx.float16, key=key) + loc
-        self.assertTrue(mx.allclose(a, b))
+        b = _compiled_loc_scale(mx.random.normal, (3, 2), mx.float16)(key, loc, scale)
+        checks.append(mx.allclose(a, b))
 
         self.assertEqual(mx.random.normal().dtype, mx.random.normal(dtype=None).dtype)
 
         # Test not getting -inf or inf with half precison
         for hp in [mx.float16, mx.bfloat16]:
-            a = abs(mx.random.normal(shape=(10000,), loc=0, scale=1, dtype=hp))
-            self.assertTrue(mx.all(a < mx.inf))
+            a = mx.random.normal(shape=(10000,), loc=0, scale=1, dtype=hp)
+            checks.append(mx.all(mx.abs(a) < mx.inf))
+
+        mx.eval(checks)
+        for check in checks:
+            self.assertTrue(check.item())
 
     def test_multivariate_normal(self):
-        key = mx.random.key(0)
+        key = self._key0
         mean = mx.array([0, 0])
         cov = mx.array([[1, 0], [0, 1]])
 
@@ -159,12 +192,13 @@ class TestRandom(mlx_tests.MLXTestCase):
         self.assertEqual(a.shape, (4, 3, 2))
 
         ## Check correcteness of the mean and covariance
-        n_test = int(1e5)
+        n_test = int(2e4)
 
         def check_jointly_gaussian(data, mean, cov):
             empirical_mean = mx.mean(data, axis=0)
+            centered = data - empirical_mean
             empirical_cov = (
-                (data - empirical_mean).T @ (data - empirical_mean) / data.shape[0]
+                mx.matmul(centered.swapaxes(-1, -2), centered) / data.shape[0]
             )
             N = data.shape[1]
             self.assertTrue(
@@ -178,19 +212,22 @@ class TestRandom(mlx_tests.MLXTestCase):
                 )
             )
 
-        mean = mx.array([4.0, 7.0])
-        cov = mx.array([[2, 0.5], [0.5, 1]])
-        data = mx.random.multivariate_normal(
-            mean, cov, shape=(n_test,), key=key, stream=mx.cpu
+        mean_2d = mx.array([4.0, 7.0])
+        cov_2d = mx.array([[2, 0.5], [0.5, 1]])
+        data_2d = mx.random.multivariate_normal(
+            mean_2d, cov_2d, shape=(n_test,), key=key, stream=mx.cpu
         )
-        check_jointly_gaussian(data, mean, cov)
 
-        mean = mx.arange(3)
-        cov = mx.array([[1, -1, 0.5], [-1, 1, -0.5], [0.5, -0.5, 1]])
-        data = mx.random.multivariate_normal(
-            mean, cov, shape=(n_test,), key=key, stream=mx.cpu
+        mean_3d = mx.arange(3)
+        cov_3d = mx.array([[1, -1, 0.5], [-1, 1, -0.5], [0.5, -0.5, 1]])
+        data_3d = mx.random.multivariate_normal(
+            mean_3d, cov_3d, shape=(n_test,), key=key, stream=mx.cpu
         )
-        check_jointly_gaussian(data, mean, cov)
+
+        # Evaluate both samplers in one batch
+        mx.eval(data_2d, data_3d)
+        check_jointly_gaussian(data_2d, mean_2d, cov_2d)
+        check_jointly_gaussian(data_3d, mean_3d, cov_3d)
 
     def test_randint(self):
         a = mx.random.randint(0, 1, [])
@@ -201,14 +238,14 @@ class TestRandom(mlx_tests.MLXTestCase):
         low = mx.array(3)
         high = mx.array(15)
 
-        key = mx.random.key(0)
+        key = self._key0
         a = mx.random.randint(low, high, shape, key=key)
         self.assertEqual(a.shape, shape)
         self.assertEqual(a.dtype, mx.int32)
 
         # Check using the same key yields the same value
         b = mx.random.randint(low, high, shape, key=key)
-        self.assertListEqual(a.tolist(), b.tolist())
+        self.assertTrue(mx.array_equal(a, b))
 
         shape = (3, 4)
         low = mx.reshape(mx.array([0] * 3), [3, 1])
@@ -218,7 +255,7 @@ class TestRandom(mlx_tests.MLXTestCase):
         self.assertEqual(a.shape, shape)
 
         a = mx.random.randint(-10, 10, [1000, 1000])
-        self.assertTrue(mx.all(-10 <= a).item() and mx.all(a < 10).item())
+        self.assertTrue(mx.all(mx.logical_and(a >= -10, a < 10)).item())
 
         a = mx.random.randint(10, -10, [1000, 1000])
         self.assertTrue(mx.all(a == 10).item())
@@ -240,7 +277,6 @@ class TestRandom(mlx_tests.MLXTestCase):
         self.assertEqual(a.shape, (2,))
 
         p = mx.array([0.1, 0.2, 0.3])
-        mx.reshape(p, [1, 3])
         x = mx.random.bernoulli(p, [4, 3])
         self.assertEqual(x.shape, (4, 3))
 
@@ -264,13 +300,17 @@ class TestRandom(mlx_tests.MLXTestCase):
         a = mx.random.truncated_normal(lower, upper)
 
         self.assertEqual(a.shape, (3, 2))
-        self.assertTrue(mx.all(lower <= a).item() and mx.all(a <= upper).item())
+        self.assertTrue(mx.all(mx.logical_and(lower <= a, a <= upper)).item())
 
         a = mx.random.truncated_normal(2.0, -2.0)
         self.assertTrue(mx.all(a == 2.0).item())
 
+        # Shapes are computed without evaluating, so drop the array right
+        # after the assertion to guarantee the 542 * 399 samples are never
+        # materialized
         a = mx.random.truncated_normal(-3.0, 3.0, [542, 399])
         self.assertEqual(a.shape, (542, 399))
+        del a
 
         lower = mx.array([-2.0, -1.0])
         higher = mx.array([1.0, 2.0, 3.0])
@@ -283,13 +323,13 @@ class TestRandom(mlx_tests.MLXTestCase):
         )
 
     def test_gumbel(self):
-        samples = mx.random.gumbel(shape=(100, 100))
-        self.assertEqual(samples.shape, (100, 100))
+        samples = mx.random.gumbel(shape=(32, 32))
+        self.assertEqual(samples.shape, (32, 32))
         self.assertEqual(samples.dtype, mx.float32)
         mean = 0.5772
-        # Std deviation of the sample mean is small (<0.02),
+        # Std deviation of the sample mean is small (~0.04),
         # so this test is pretty conservative
-        self.assertTrue(mx.abs(mx.mean(samples) - mean) < 0.2)
+        self.assertTrue((mx.abs(mx.mean(samples) - mean) < 0.2).item())
 
         self.assertEqual(
             mx.random.gumbel((1, 1)).dtype, mx.random.gumbel((1, 1), dtype=None).dtype
@@ -297,6 +337,9 @@ class TestRandom(mlx_tests.MLXTestCase):
 
     def test_categorical(self):
         logits = mx.zeros((10, 20))
+        # Materialize once so the zero fill is not a dependency of every
+        # categorical call below
+        mx.eval(logits)
         self.assertEqual(mx.random.categorical(logits, -1).shape, (10,))
         self.assertEqual(mx.random.categorical(logits, 0).shape, (20,))
         self.assertEqual(mx.random.categorical(logits, 1).shape, (10,))
@@ -304,11 +347,13 @@ class TestRandom(mlx_tests.MLXTestCase):
         out = mx.random.categorical(logits)
         self.assertEqual(out.shape, (10,))
         self.assertEqual(out.dtype, mx.uint32)
-        self.assertTrue(mx.max(out).item() < 20)
 
-        out = mx.random.categorical(logits, 0, [5, 20])
-        self.assertEqual(out.shape, (5, 20))
-        self.assertTrue(mx.max(out).item() < 10)
+        out2 = mx.random.categorical(logits, 0, [5, 20])
+        self.assertEqual(out2.shape, (5, 20))
+
+        # Check both maxima with a single reduction and sync
+        in_bounds = mx.stack([mx.max(out) < 20, mx.max(out2) < 10])
+        self.assertTrue(mx.all(in_bounds).item())
 
         out = mx.random.categorical(logits, 1, num_samples=7)
         self.assertEqual(out.shape, (10, 7))